@@ -1,18 +1,133 @@
 # LangChain Anthropic Chatbot
 # A comprehensive chatbot implementation using LangChain with Anthropic's Claude API
 
+from __future__ import annotations
+
+import functools
+import hashlib
+import importlib.util
 import os
-from typing import List, Dict, Any
-import streamlit as st
-from langchain_anthropic import ChatAnthropic
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.chat_message_histories import StreamlitChatMessageHistory
-from langchain_core.runnables.history import RunnableWithMessageHistory
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Callable, Iterator, List, Dict, Any, Optional
 import asyncio
 
+# Streamlit, LangChain and the Anthropic SDK are imported where they are
+# first needed, so the CLI does not pay for modules it never uses
+if TYPE_CHECKING:
+    import anthropic
+    from langchain_core.chat_history import BaseChatMessageHistory
+    from langchain_core.messages import BaseMessage
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+
+# Number of deterministic (temperature 0) responses memoized per chatbot
+RESPONSE_CACHE_SIZE = 128
+
+# Exchanges kept in the Streamlit history; older ones are evicted
+MAX_HISTORY_TURNS = 100
+
+# Most recent history messages sent verbatim; older ones are replaced by a
+# running summary that is extended each time SUMMARY_REFRESH_MESSAGES more
+# have aged out. Both are even so that user/assistant pairs stay together.
+# Each conversation keeps one cached summary, so the cache holds one entry
+# per active conversation.
+HISTORY_WINDOW_MESSAGES = 20
+SUMMARY_REFRESH_MESSAGES = 10
+SUMMARY_CACHE_SIZE = 128
+
+_SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation below in a short paragraph. Keep the names, "
+    "facts, preferences and decisions needed to continue it."
+)
+
+def _orjson_request_builder(build_request: Callable) -> Callable:
+    """Wrap an httpx client's build_request so JSON bodies are encoded by orjson"""
+    try:
+        import orjson
+    except ImportError:
+        return build_request
+    import httpx
+    
+    @functools.wraps(build_request)
+    def wrapper(method, url, *, json=None, content=None, headers=None, **kwargs):
+        # httpx ignores json for multipart and form requests, so leave those alone
+        if json is None or content is not None or kwargs.get("files") or kwargs.get("data"):
+            return build_request(method, url, json=json, content=content, headers=headers, **kwargs)
+        
+        headers = httpx.Headers(headers)
+        headers.setdefault("Content-Type", "application/json")
+        return build_request(method, url, content=orjson.dumps(json), headers=headers, **kwargs)
+    
+    return wrapper
+
+@functools.lru_cache(maxsize=None)
+def _shared_http_client():
+    """Connection pool shared by every Anthropic client in the process"""
+    import anthropic
+    import httpx
+    
+    # HTTP/2 needs the optional h2 package (pip install httpx[http2])
+    client = anthropic.DefaultHttpxClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+    )
+    client.build_request = _orjson_request_builder(client.build_request)
+    return client
+
+@functools.lru_cache(maxsize=None)
+def _shared_async_http_client():
+    """Async counterpart of _shared_http_client"""
+    import anthropic
+    import httpx
+    
+    client = anthropic.DefaultAsyncHttpxClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+    )
+    client.build_request = _orjson_request_builder(client.build_request)
+    return client
+
+def _message_turn(message: Any) -> tuple:
+    """(role, content) of a message or role/content dict, for hashing"""
+    if isinstance(message, dict):
+        return message["role"], message["content"]
+    return message.type, message.content
+
+class _WindowedHistory(list):
+    """History that has already been through AnthropicChatbot._window_history"""
+
+@functools.lru_cache(maxsize=16)
+def _build_prompt(system_prompt: str) -> ChatPromptTemplate:
+    """Prompt template for a system prompt, shared by chatbots that use the same one"""
+    from langchain_core.messages import SystemMessage
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    
+    # Mark the system prompt for Anthropic prompt caching so follow-up turns
+    # reuse its prefill; prompts below the model's minimum length are not cached
+    system_message = SystemMessage(content=[{
+        "type": "text",
+        "text": system_prompt,
+        "cache_control": {"type": "ephemeral"}
+    }])
+    
+    return ChatPromptTemplate.from_messages([
+        system_message,
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "{input}")
+    ])
+
+@functools.lru_cache(maxsize=None)
+def _str_parser() -> StrOutputParser:
+    """Stateless output parser shared by every chain"""
+    from langchain_core.output_parsers import StrOutputParser
+    
+    return StrOutputParser()
+
 # Configuration
 class ChatbotConfig:
     """Configuration settings for the chatbot"""
@@ -24,14 +139,30 @@ class ChatbotConfig:
 
 # Initialize the chatbot
 class AnthropicChatbot:
-    def __init__(self, config: ChatbotConfig):
+    def __init__(self, config: ChatbotConfig,
+                 get_session_history: Callable[[str], BaseChatMessageHistory] = None):
         self.config = config
+        self._histories: Dict[str, BaseChatMessageHistory] = {}
+        self.get_session_history = get_session_history or self._in_memory_history
+        
+        # Memoized temperature-0 responses, least recently used first
+        self._cache: OrderedDict[bytes, str] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        
+        # Running summaries of aged-out history, keyed by id() of the last
+        # message they cover: {id: (message, summary)}
+        self._summaries: OrderedDict[int, tuple] = OrderedDict()
+        # Locks for summaries being generated, so concurrent callers wait for one
+        self._summary_locks: Dict[int, threading.Lock] = {}
         self.setup_llm()
         self.setup_prompt_template()
         self.setup_chain()
     
     def setup_llm(self):
         """Initialize the Anthropic LLM"""
+        import anthropic
+        from langchain_anthropic import ChatAnthropic
+        
         api_key = os.getenv("ANTHROPIC_API_KEY")
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is required")
@@ -40,43 +171,301 @@ class AnthropicChatbot:
             model=self.config.model_name,
             temperature=self.config.temperature,
             max_tokens=self.config.max_tokens,
-            anthropic_api_key=api_key
+            anthropic_api_key=api_key,
+            model_kwargs={"extra_headers": {"anthropic-beta": "prompt-caching-2024-07-31"}}
+        )
+        
+        # ChatAnthropic takes no http_client argument, so seed the SDK clients
+        # it would otherwise build lazily with ones on the shared pools. Its
+        # own client params keep the key, base URL, retries, timeout and headers
+        client_params = self.llm._client_params
+        self.llm._client = anthropic.Client(**{**client_params, "http_client": _shared_http_client()})
+        self.llm._async_client = anthropic.AsyncClient(
+            **{**client_params, "http_client": _shared_async_http_client()}
         )
     
     def setup_prompt_template(self):
         """Setup the prompt template with system message and chat history"""
-        self.prompt = ChatPromptTemplate.from_messages([
-            SystemMessage(content=self.config.system_prompt),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{input}")
-        ])
+        self.prompt = _build_prompt(self.config.system_prompt)
     
     def setup_chain(self):
         """Setup the LangChain chain"""
-        self.chain = self.prompt | self.llm | StrOutputParser()
+        from langchain_core.runnables import RunnablePassthrough
+        from langchain_core.runnables.history import RunnableWithMessageHistory
+        
+        self.chain = (
+            RunnablePassthrough.assign(chat_history=self._window_history)
+            | self.prompt
+            | self.llm
+            | _str_parser()
+        )
+        
+        # LangChain keeps the conversation itself and only appends new turns
+        self.conversation = RunnableWithMessageHistory(
+            self.chain,
+            self.get_session_history,
+            input_messages_key="input",
+            history_messages_key="chat_history"
+        )
     
-    def get_response(self, user_input: str, chat_history: List[Dict[str, str]] = None) -> str:
-        """Get response from the chatbot"""
+    def _window_history(self, inputs: Dict[str, Any]) -> List[BaseMessage]:
+        """Keep the latest history verbatim and fold older messages into a summary"""
+        from langchain_core.messages import SystemMessage
+        
+        # History may be any sequence of messages or role/content dicts;
+        # MessagesPlaceholder converts the items but only accepts a list
+        messages = inputs["chat_history"]
+        if isinstance(messages, _WindowedHistory):
+            return messages
+        if not isinstance(messages, list):
+            messages = list(messages)
+        if len(messages) <= HISTORY_WINDOW_MESSAGES:
+            return messages
+        
+        # Resume from the newest summary of this conversation
+        start, summary = self._find_summary(messages)
+        overflow = len(messages) - start - HISTORY_WINDOW_MESSAGES
+        if overflow > 0:
+            # Extend in SUMMARY_REFRESH_MESSAGES steps so one summary serves several turns
+            cut = start + -(-overflow // SUMMARY_REFRESH_MESSAGES) * SUMMARY_REFRESH_MESSAGES
+            summary = self._extend_summary(messages, start, cut, summary)
+            start = cut
+        
+        return _WindowedHistory(
+            [SystemMessage(content=f"Earlier conversation summary: {summary}")] + messages[start:]
+        )
+    
+    def _cached_summary(self, message: Any) -> Optional[str]:
+        """Cached summary ending at this exact message object, if any"""
+        with self._cache_lock:
+            entry = self._summaries.get(id(message))
+            # The stored reference keeps the id from being reused while cached
+            if entry is None or entry[0] is not message:
+                return None
+            self._summaries.move_to_end(id(message))
+            return entry[1]
+    
+    def _find_summary(self, messages: List[Any]) -> tuple:
+        """(end, summary) of the newest cached summary covering messages[:end], or (0, None)
+        
+        Summaries are matched by message identity rather than content, so a
+        summary only ever resumes in the conversation it was made for, and
+        stays valid when the oldest messages are dropped from the history.
+        """
+        # After a cut at least HISTORY_WINDOW_MESSAGES - SUMMARY_REFRESH_MESSAGES + 1
+        # messages stay verbatim, so no summary can end later than this
+        last_end = min(len(messages), len(messages) - HISTORY_WINDOW_MESSAGES + SUMMARY_REFRESH_MESSAGES)
+        for end in range(last_end, SUMMARY_REFRESH_MESSAGES - 1, -1):
+            summary = self._cached_summary(messages[end - 1])
+            if summary is not None:
+                return end, summary
+        return 0, None
+    
+    def _extend_summary(self, messages: List[Any], start: int, cut: int,
+                        previous: Optional[str]) -> str:
+        """Summary of messages[:cut], generated once even with concurrent callers"""
+        from langchain_core.messages import convert_to_messages
+        
+        last = messages[cut - 1]
+        with self._cache_lock:
+            lock = self._summary_locks.setdefault(id(last), threading.Lock())
+        
+        try:
+            with lock:
+                summary = self._cached_summary(last)
+                if summary is None:
+                    summary = self._summarize(previous, convert_to_messages(messages[start:cut]))
+                    with self._cache_lock:
+                        self._summaries[id(last)] = (last, summary)
+                        if len(self._summaries) > SUMMARY_CACHE_SIZE:
+                            self._summaries.popitem(last=False)
+        finally:
+            with self._cache_lock:
+                self._summary_locks.pop(id(last), None)
+        return summary
+    
+    def _summarize(self, previous: Optional[str], messages: List[BaseMessage]) -> str:
+        """Extend a running summary (or start one) with messages that aged out"""
+        from langchain_core.messages import HumanMessage
+        
+        transcript = "\n".join(f"{m.type}: {m.content}" for m in messages)
+        if previous:
+            transcript = f"Summary so far: {previous}\n\nNew messages:\n{transcript}"
+        return (self.llm | _str_parser()).invoke([
+            HumanMessage(content=f"{_SUMMARY_INSTRUCTIONS}\n\n{transcript}")
+        ])
+    
+    def _in_memory_history(self, session_id: str) -> BaseChatMessageHistory:
+        """Default session history store, used outside of Streamlit"""
+        from langchain_core.chat_history import InMemoryChatMessageHistory
+        
+        if session_id not in self._histories:
+            self._histories[session_id] = InMemoryChatMessageHistory()
+        return self._histories[session_id]
+    
+    def _cache_key(self, user_input: str, chat_history: List[BaseMessage],
+                   session_id: str) -> Optional[bytes]:
+        """Memo key for a deterministic request, or None when responses are sampled"""
+        if self.config.temperature >= 1e-6:
+            return None
+        
         if chat_history is None:
-            chat_history = []
+            chat_history = self.get_session_history(session_id).messages
+        turns = tuple(_message_turn(m) for m in chat_history)
+        request = (self.config.model_name, self.config.max_tokens, self.config.system_prompt,
+                   user_input, turns)
+        return hashlib.sha256(repr(request).encode()).digest()
+    
+    def _cached_response(self, key: Optional[bytes], user_input: str,
+                         chat_history: List[BaseMessage], session_id: str) -> Optional[str]:
+        """Look up a memoized response, recording the turn in the session history on a hit"""
+        if key is None:
+            return None
         
-        # Convert chat history to LangChain message format
-        messages = []
-        for msg in chat_history:
-            if msg["role"] == "user":
-                messages.append(HumanMessage(content=msg["content"]))
-            else:
-                messages.append(AIMessage(content=msg["content"]))
+        with self._cache_lock:
+            response = self._cache.get(key)
+            if response is None:
+                return None
+            self._cache.move_to_end(key)
         
-        response = self.chain.invoke({
-            "input": user_input,
-            "chat_history": messages
-        })
+        if chat_history is None:
+            from langchain_core.messages import HumanMessage, AIMessage
+            
+            self.get_session_history(session_id).add_messages([
+                HumanMessage(content=user_input),
+                AIMessage(content=response)
+            ])
+        return response
+    
+    def _remember_response(self, key: Optional[bytes], response: str):
+        """Memoize a response, evicting the least recently used beyond RESPONSE_CACHE_SIZE"""
+        if key is None:
+            return
+        
+        with self._cache_lock:
+            self._cache[key] = response
+            self._cache.move_to_end(key)
+            if len(self._cache) > RESPONSE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+    
+    def get_response(self, user_input: str, chat_history: List[BaseMessage] = None,
+                     session_id: str = "default") -> str:
+        """Get response from the chatbot
         
+        Without an explicit chat_history the conversation is read from, and
+        appended to, the session history for session_id. An explicit history
+        of messages (or role/content dicts) is passed to the chain as is.
+        """
+        key = self._cache_key(user_input, chat_history, session_id)
+        cached = self._cached_response(key, user_input, chat_history, session_id)
+        if cached is not None:
+            return cached
+        
+        if chat_history is None:
+            response = self.conversation.invoke(
+                {"input": user_input},
+                config={"configurable": {"session_id": session_id}}
+            )
+        else:
+            response = self.chain.invoke({
+                "input": user_input,
+                "chat_history": chat_history
+            })
+        
+        self._remember_response(key, response)
         return response
+    
+    def stream_response(self, user_input: str, chat_history: List[BaseMessage] = None,
+                        session_id: str = "default") -> Iterator[str]:
+        """Yield the response in chunks as the model generates it"""
+        key = self._cache_key(user_input, chat_history, session_id)
+        cached = self._cached_response(key, user_input, chat_history, session_id)
+        if cached is not None:
+            yield cached
+            return
+        
+        if chat_history is None:
+            stream = self.conversation.stream(
+                {"input": user_input},
+                config={"configurable": {"session_id": session_id}}
+            )
+        else:
+            stream = self.chain.stream({
+                "input": user_input,
+                "chat_history": chat_history
+            })
+        
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        self._remember_response(key, "".join(chunks))
+    
+    async def aget_response(self, user_input: str, chat_history: List[BaseMessage] = None,
+                            session_id: str = "default") -> str:
+        """Async version of get_response"""
+        key = self._cache_key(user_input, chat_history, session_id)
+        cached = self._cached_response(key, user_input, chat_history, session_id)
+        if cached is not None:
+            return cached
+        
+        if chat_history is None:
+            response = await self.conversation.ainvoke(
+                {"input": user_input},
+                config={"configurable": {"session_id": session_id}}
+            )
+        else:
+            response = await self.chain.ainvoke({
+                "input": user_input,
+                "chat_history": chat_history
+            })
+        
+        self._remember_response(key, response)
+        return response
+    
+    async def abatch(self, prompts: List[str], max_concurrency: int = 10) -> List[str]:
+        """Answer independent prompts concurrently, each without chat history"""
+        return await self.chain.abatch(
+            [{"input": p, "chat_history": []} for p in prompts],
+            config={"max_concurrency": max_concurrency}
+        )
+
+def streamlit_history(session_id: str) -> BaseChatMessageHistory:
+    """Session history stored in Streamlit's per-browser session state"""
+    import streamlit as st
+    from langchain_community.chat_message_histories import StreamlitChatMessageHistory
+    
+    # Cap memory and prompt size by dropping the oldest exchanges in place.
+    # Turns are stored in user/assistant pairs, so whole exchanges go; the
+    # list stays a list because MessagesPlaceholder rejects other sequences
+    messages = st.session_state.setdefault("lc_history", [])
+    if len(messages) > MAX_HISTORY_TURNS * 2:
+        del messages[:len(messages) - MAX_HISTORY_TURNS * 2]
+    return StreamlitChatMessageHistory(key="lc_history")
+
+def _build_chatbot(model_name: str, temperature: float, max_tokens: int, system_prompt: str,
+                   api_key: str) -> AnthropicChatbot:
+    """Build the chatbot once per configuration; main() wraps this in st.cache_resource
+    
+    api_key is only part of the cache key; setup_llm reads it from the
+    environment. Histories live in session state, so sharing is safe.
+    """
+    config = ChatbotConfig()
+    config.model_name = model_name
+    config.temperature = temperature
+    config.max_tokens = max_tokens
+    config.system_prompt = system_prompt
+    
+    return AnthropicChatbot(config, get_session_history=streamlit_history)
 
 # Streamlit UI
 def main():
+    import streamlit as st
+    
+    # Streamlit keys the cache on the function's code, so wrapping it on
+    # every rerun still hits the same cached chatbots
+    build_chatbot = st.cache_resource(_build_chatbot)
+    
     st.set_page_config(
         page_title="LangChain Anthropic Chatbot",
         page_icon="🤖",
@@ -136,45 +525,37 @@ def main():
         
         # Clear chat button
         if st.button("Clear Chat History"):
-            st.session_state.messages = []
+            streamlit_history("default").clear()
             st.rerun()
     
     # Initialize chatbot
     if api_key:
         try:
-            config = ChatbotConfig()
-            config.model_name = model_choice
-            config.temperature = temperature
-            config.max_tokens = max_tokens
-            config.system_prompt = system_prompt
-            
-            chatbot = AnthropicChatbot(config)
-            
-            # Initialize chat history
-            if "messages" not in st.session_state:
-                st.session_state.messages = []
+            # Reuse this session's chatbot until a chain-relevant setting changes
+            cfg_hash = hash((model_choice, temperature, max_tokens, system_prompt, api_key))
+            if st.session_state.get("_cfg_hash") == cfg_hash and "chatbot" in st.session_state:
+                chatbot = st.session_state.chatbot
+            else:
+                chatbot = build_chatbot(model_choice, temperature, max_tokens, system_prompt, api_key)
+                st.session_state.chatbot = chatbot
+                st.session_state._cfg_hash = cfg_hash
             
-            # Display chat history
-            for message in st.session_state.messages:
-                with st.chat_message(message["role"]):
-                    st.markdown(message["content"])
+            # Display chat history ("human"/"ai" are valid chat_message names)
+            for message in streamlit_history("default").messages:
+                with st.chat_message(message.type):
+                    st.markdown(message.content)
             
             # Chat input
             if prompt := st.chat_input("What would you like to know?"):
-                # Add user message to chat history
-                st.session_state.messages.append({"role": "user", "content": prompt})
                 with st.chat_message("user"):
                     st.markdown(prompt)
                 
-                # Get bot response
+                # Stream bot response; the chain records both turns in the history
                 with st.chat_message("assistant"):
-                    with st.spinner("Thinking..."):
-                        try:
-                            response = chatbot.get_response(prompt, st.session_state.messages[:-1])
-                            st.markdown(response)
-                            st.session_state.messages.append({"role": "assistant", "content": response})
-                        except Exception as e:
-                            st.error(f"Error: {str(e)}")
+                    try:
+                        st.write_stream(chatbot.stream_response(prompt))
+                    except Exception as e:
+                        st.error(f"Error: {str(e)}")
             
         except Exception as e:
             st.error(f"Failed to initialize chatbot: {str(e)}")
@@ -193,10 +574,17 @@ class CLIChatbot:
     def __init__(self):
         self.config = ChatbotConfig()
         self.chatbot = AnthropicChatbot(self.config)
-        self.chat_history = []
+        self.chat_history: List[BaseMessage] = []
     
     def run(self):
         """Run the CLI version of the chatbot"""
+        # Prompts piped in as a newline list are answered concurrently
+        if not sys.stdin.isatty():
+            self.run_batch(self._read_piped_prompts())
+            return
+        
+        from langchain_core.messages import HumanMessage, AIMessage
+        
         print("🤖 LangChain Anthropic Chatbot")
         print("Type 'quit' to exit, 'clear' to clear history")
         print("-" * 50)
@@ -215,57 +603,236 @@ class CLIChatbot:
                 continue
             
             try:
-                response = self.chatbot.get_response(user_input, self.chat_history)
-                print(f"\nAssistant: {response}")
+                print("\nAssistant: ", end="", flush=True)
+                chunks = []
+                for chunk in self.chatbot.stream_response(user_input, self.chat_history):
+                    print(chunk, end="", flush=True)
+                    chunks.append(chunk)
+                print()
+                response = "".join(chunks)
                 
-                # Update chat history
-                self.chat_history.append({"role": "user", "content": user_input})
-                self.chat_history.append({"role": "assistant", "content": response})
+                # Update chat history with messages the chain can use directly
+                self.chat_history.append(HumanMessage(content=user_input))
+                self.chat_history.append(AIMessage(content=response))
                 
             except Exception as e:
                 print(f"Error: {str(e)}")
+    
+    def _read_piped_prompts(self) -> List[str]:
+        """Read prompts from piped stdin, honouring the interactive commands
+        
+        Reading stops at 'quit'; 'clear' is skipped since batch prompts are
+        answered independently anyway.
+        """
+        prompts = []
+        for line in sys.stdin:
+            line = line.strip()
+            if line.lower() == 'quit':
+                break
+            if line and line.lower() != 'clear':
+                prompts.append(line)
+        return prompts
+    
+    def run_batch(self, prompts: List[str]):
+        """Answer a list of independent prompts concurrently"""
+        if not prompts:
+            return
+        
+        try:
+            responses = asyncio.run(self.chatbot.abatch(prompts))
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            return
+        
+        for prompt, response in zip(prompts, responses):
+            print(f"You: {prompt}")
+            print(f"Assistant: {response}\n")
+
+# Numbered answer markers in a marshaled response, e.g. "[3]: ..."
+_MARSHALED_ANSWER = re.compile(r"^\[(\d+)\]:?[ \t]*", re.MULTILINE)
 
 # Advanced features
 class AdvancedChatbot(AnthropicChatbot):
     """Extended chatbot with additional features"""
     
-    def __init__(self, config: ChatbotConfig):
-        super().__init__(config)
+    def __init__(self, config: ChatbotConfig,
+                 get_session_history: Callable[[str], BaseChatMessageHistory] = None):
+        super().__init__(config, get_session_history)
         self.setup_advanced_features()
     
     def setup_advanced_features(self):
         """Setup advanced features like memory and tools"""
-        # You can add more advanced features here
-        pass
+        # Plain Anthropic client for the Message Batches API, created on first use
+        self._batch_client = None
+        # Number of prompts in each batch submitted by this chatbot
+        self._offline_batch_sizes: Dict[str, int] = {}
+    
+    @property
+    def batch_client(self) -> anthropic.Anthropic:
+        """Anthropic client used for offline batch jobs"""
+        import anthropic
+        
+        if self._batch_client is None:
+            self._batch_client = anthropic.Anthropic(
+                api_key=os.getenv("ANTHROPIC_API_KEY"),
+                http_client=_shared_http_client()
+            )
+        return self._batch_client
     
-    def get_response_with_sources(self, user_input: str, chat_history: List[Dict[str, str]] = None):
+    def get_response_with_sources(self, user_input: str, chat_history: List[BaseMessage] = None):
         """Get response with source information"""
         response = self.get_response(user_input, chat_history)
         
-        # Add metadata or source information
-        metadata = {
-            "model": self.config.model_name,
-            "temperature": self.config.temperature,
-            "timestamp": "2024-01-15T10:30:00Z"  # You'd use actual timestamp
+        return {
+            "response": response,
+            "metadata": self._build_metadata(user_input)
         }
+    
+    async def aget_response_with_sources(self, user_input: str, chat_history: List[BaseMessage] = None):
+        """Async version of get_response_with_sources, building the metadata while the model answers"""
+        response, metadata = await asyncio.gather(
+            self.aget_response(user_input, chat_history),
+            self._build_metadata_async(user_input)
+        )
         
         return {
             "response": response,
             "metadata": metadata
         }
+    
+    def _build_metadata(self, user_input: str) -> Dict[str, Any]:
+        """Metadata or source information for a response"""
+        return {
+            "model": self.config.model_name,
+            "temperature": self.config.temperature,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+    
+    async def _build_metadata_async(self, user_input: str) -> Dict[str, Any]:
+        """Async version of _build_metadata
+        
+        Runs concurrently with the model call in aget_response_with_sources, so
+        slower work added here (token counting, audit logging) overlaps with it.
+        """
+        return self._build_metadata(user_input)
+    
+    def _batch_inputs(self, prompts: List[str], chat_history: List[BaseMessage] = None) -> List[Dict[str, Any]]:
+        """Build chain inputs for independent prompts sharing one chat history"""
+        # Window the shared history once, not once per prompt
+        messages = self._window_history({"chat_history": chat_history or []})
+        return [{"input": p, "chat_history": messages} for p in prompts]
+    
+    def process_many(self, prompts: List[str], chat_history: List[BaseMessage] = None,
+                     max_concurrency: int = 10) -> List[str]:
+        """Answer many independent prompts with up to max_concurrency requests in flight"""
+        return self.chain.batch(
+            self._batch_inputs(prompts, chat_history),
+            config={"max_concurrency": max_concurrency}
+        )
+    
+    def marshaled_invoke(self, prompts: List[str], marshal_size: int = 10,
+                         max_concurrency: int = 10) -> List[str]:
+        """Answer many short prompts by packing marshal_size of them into each request
+        
+        Returns one answer per prompt, in order; an answer the model left out
+        comes back as an empty string. Whitespace inside each prompt, newlines
+        included, is collapsed to single spaces so every prompt stays on its
+        own numbered line.
+        """
+        if marshal_size < 1:
+            raise ValueError("marshal_size must be at least 1")
+        
+        groups = [prompts[i:i + marshal_size] for i in range(0, len(prompts), marshal_size)]
+        marshaled = [
+            "Answer each independently, prefix each with [N]:\n"
+            + "\n".join(f"[{n}] {' '.join(p.split())}" for n, p in enumerate(group, start=1))
+            for group in groups
+        ]
+        responses = self.process_many(marshaled, max_concurrency=max_concurrency)
+        
+        answers = []
+        for group, response in zip(groups, responses):
+            parts = _MARSHALED_ANSWER.split(response)
+            # parts is [preamble, number, answer, number, answer, ...]
+            by_number = {int(n): a.strip() for n, a in zip(parts[1::2], parts[2::2])}
+            answers.extend(by_number.get(n, "") for n in range(1, len(group) + 1))
+        return answers
+    
+    def submit_offline_batch(self, prompts: List[str]) -> str:
+        """Queue prompts on the Message Batches API and return the batch id
+        
+        Batches are billed at a discount and do not count against the
+        interactive rate limits, but may take up to 24 hours to finish.
+        """
+        batch = self.batch_client.messages.batches.create(requests=[
+            {
+                "custom_id": str(i),
+                "params": {
+                    "model": self.config.model_name,
+                    "max_tokens": self.config.max_tokens,
+                    "temperature": self.config.temperature,
+                    "system": self.config.system_prompt,
+                    "messages": [{"role": "user", "content": prompt}]
+                }
+            }
+            for i, prompt in enumerate(prompts)
+        ])
+        self._offline_batch_sizes[batch.id] = len(prompts)
+        return batch.id
+    
+    def collect_offline_batch(self, batch_id: str, poll_interval: float = 30.0) -> List[str]:
+        """Wait for a submitted batch to end and return its responses in prompt order
+        
+        Requests that errored, expired, were canceled or are missing from the
+        results come back as None, so every answer stays in its prompt's slot.
+        """
+        batch = self.batch_client.messages.batches.retrieve(batch_id)
+        while batch.processing_status != "ended":
+            time.sleep(poll_interval)
+            batch = self.batch_client.messages.batches.retrieve(batch_id)
+        
+        # Batches submitted elsewhere are sized from the API's request counts
+        num_prompts = self._offline_batch_sizes.pop(batch_id, None)
+        if num_prompts is None:
+            counts = batch.request_counts
+            num_prompts = (counts.processing + counts.succeeded + counts.errored
+                           + counts.canceled + counts.expired)
+        
+        responses = {}
+        for entry in self.batch_client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                responses[int(entry.custom_id)] = "".join(
+                    block.text for block in entry.result.message.content if block.type == "text"
+                )
+            else:
+                responses[int(entry.custom_id)] = None
+        return [responses.get(i) for i in range(num_prompts)]
+    
+    async def aprocess_many(self, prompts: List[str], chat_history: List[BaseMessage] = None,
+                            max_concurrency: int = 10) -> List[str]:
+        """Async version of process_many"""
+        # Windowing may call the model to summarize, so keep it off the event loop
+        inputs = await asyncio.to_thread(self._batch_inputs, prompts, chat_history)
+        return await self.chain.abatch(
+            inputs,
+            config={"max_concurrency": max_concurrency}
+        )
 
-if __name__ == "__main__":
-    # Check if running in Streamlit
+def _running_in_streamlit() -> bool:
+    """Whether this script is being executed by `streamlit run`"""
+    # `python chatbot.py` never imports streamlit, so skip loading it just to check
+    if "streamlit" not in sys.modules:
+        return False
+    
     try:
-        import streamlit as st
-        # If we can import streamlit and it's running, use Streamlit UI
-        main()
+        from streamlit.runtime import exists
     except ImportError:
-        # If streamlit is not available, use CLI
-        print("Streamlit not available. Using CLI version.")
-        cli_bot = CLIChatbot()
-        cli_bot.run()
-    except Exception:
-        # Fallback to CLI if there are any issues with Streamlit
+        return False
+    return exists()
+
+if __name__ == "__main__":
+    if _running_in_streamlit():
+        main()
+    else:
         cli_bot = CLIChatbot()
         cli_bot.run()